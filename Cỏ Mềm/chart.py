@@ -2,9 +2,28 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 import numpy as np
+import glob
+import hashlib
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import warnings
 
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+except ImportError:
+    pa = None
+
+# Helpers shared by the brand scripts live next to the brand folders
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from analytics_helpers import (
+    estimate_total, get_derived_metric, load_apify_dataset, parse_datetimes,
+    preview_strata, stratified_sample, to_arrow_table,
+)
+
 warnings.filterwarnings('ignore')
 
 # Set up plotting style
@@ -12,18 +31,26 @@ plt.style.use('seaborn-v0_8')
 sns.set_palette("husl")
 
 
+def read_apify_dataset(base_name):
+    """Read an Apify dataset, preferring native JSON/NDJSON over Excel"""
+    for extension in ['.ndjson', '.jsonl', '.json']:
+        if os.path.exists(base_name + extension):
+            return load_apify_dataset(base_name + extension, sep='.')
+    return pd.read_excel(base_name + ".xlsx")
+
+
 def load_and_process_data():
     """Load and process all data sources"""
     try:
         # Load data files
-        apify = pd.read_excel("[APIFY] CỎ MỀM.xlsx")
+        apify = read_apify_dataset("[APIFY] CỎ MỀM")
         fastmoss_df = pd.read_excel("[FASTMOSS] Cỏ Mềm.xlsx")
-        fanpage = pd.read_excel("[FANPAGE KARMA] CỎ MỀM.xlsx", header=4)
+        fanpage = load_karma_profiles()
 
         print("Data loaded successfully!")
         print(f"Apify records: {len(apify)}")
         print(f"FastMoss records: {len(fastmoss_df)}")
-        print(f"Fanpage records: {len(fanpage)}")
+        print(f"Fanpage records: {len(fanpage.table)}")
 
         return apify, fastmoss_df, fanpage
 
@@ -35,13 +62,115 @@ def load_and_process_data():
         return None, None, None
 
 
+def sample_for_preview(apify, fastmoss_df, n_rows=2000, seed=0):
+    """Stratified preview samples of the Apify and FastMoss sources"""
+    designs = {}
+    if apify is not None:
+        strata = preview_strata(apify, 'createTimeISO')
+        apify, designs['apify'] = stratified_sample(apify, strata, n_rows, seed=seed)
+    if fastmoss_df is not None:
+        strata = preview_strata(fastmoss_df, 'Thời gian đăng', category_col='Phân loại KOC/KOL')
+        fastmoss_df, designs['fastmoss'] = stratified_sample(fastmoss_df, strata, n_rows, seed=seed)
+    return apify, fastmoss_df, designs
+
+
+def write_shared_store(frames, store_dir=".analytics_store"):
+    """Write loaded frames once to memory-mappable Arrow IPC files"""
+    if pa is None:
+        print("pyarrow not installed - shared store disabled")
+        return None
+
+    os.makedirs(store_dir, exist_ok=True)
+    for name, df in frames.items():
+        path = os.path.join(store_dir, f"{name}.arrow")
+        if df is None:
+            if os.path.exists(path):
+                os.remove(path)
+            continue
+
+        # Uncompressed IPC files so readers can map the buffers directly
+        table = to_arrow_table(df)
+        # Replace atomically: readers may still have the old file mapped
+        with pa.OSFile(path + '.tmp', 'wb') as sink:
+            with pa_ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(path + '.tmp', path)
+
+    return store_dir
+
+
+def read_shared_table(path):
+    """Memory-map one Arrow IPC file of the shared store as a DataFrame"""
+    table = pa_ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    # split_blocks keeps null-free numeric columns as views on the mapped file
+    return table.to_pandas(split_blocks=True)
+
+
+def attach_shared_store(store_dir=".analytics_store", names=None):
+    """Attach to frames in the shared store through memory maps"""
+    frames = {}
+    for name in names or ['apify', 'fastmoss', 'fanpage']:
+        path = os.path.join(store_dir, f"{name}.arrow")
+        frames[name] = read_shared_table(path) if os.path.exists(path) else None
+    return frames
+
+
+def _process_shared_source(store_dir, name):
+    """Worker entry point: process one source read from the shared store.
+
+    The processed frame is written back to the store and only its path and
+    the small aggregates are returned, so no frame is pickled to the parent.
+    """
+    df = attach_shared_store(store_dir, [name])[name]
+    if name == 'fanpage':
+        return process_fanpage_data(df)
+
+    processors = {
+        'apify': process_apify_data,
+        'fastmoss': process_fastmoss_data,
+    }
+    processed, *aggregates = processors[name](df)
+    if processed is None:
+        return (None, *aggregates)
+
+    output = f"{name}_processed"
+    write_shared_store({output: processed}, store_dir)
+    return (os.path.join(store_dir, f"{output}.arrow"), *aggregates)
+
+
+def process_data_parallel(apify, fastmoss_df, fanpage, store_dir=".analytics_store"):
+    """Process all sources in worker processes sharing one Arrow store"""
+    if isinstance(fanpage, KarmaProfileTable):
+        fanpage = fanpage.table
+    # Clean counts first: mixed number/text columns would be stored as text
+    if fastmoss_df is not None:
+        fastmoss_df = clean_fastmoss_numbers(fastmoss_df)
+    frames = {'apify': apify, 'fastmoss': fastmoss_df, 'fanpage': fanpage}
+    if write_shared_store(frames, store_dir) is None:
+        return (process_apify_data(apify), process_fastmoss_data(fastmoss_df),
+                process_fanpage_data(fanpage))
+
+    names = list(frames)
+    with ProcessPoolExecutor(max_workers=len(names)) as pool:
+        results = list(pool.map(_process_shared_source, [store_dir] * len(names), names))
+
+    # Attach the processed frames the workers left in the store
+    for i, name in enumerate(names):
+        if name != 'fanpage' and results[i][0] is not None:
+            results[i] = (read_shared_table(results[i][0]), *results[i][1:])
+
+    return tuple(results)
+
+
 def process_apify_data(apify):
     """Process TikTok data from Apify"""
     if apify is None:
         return None, None, None
 
     # Convert timestamp
-    apify['timestamp'] = pd.to_datetime(apify['createTimeISO'], errors='coerce')
+    apify['timestamp'], report = parse_datetimes(apify['createTimeISO'])
+    print(f"createTimeISO: {', '.join(report['formats']) or 'no format found'}, "
+          f"{report['failure_rate']:.1%} unparsed")
 
     # Extract hashtags
     def extract_hashtags(text):
@@ -104,32 +233,54 @@ def convert_vietnamese_numbers(s):
     return 0
 
 
+# Derived ratio metrics: summed numerator columns over a denominator column.
+# FastMoss creator rows only expose likes, so their engagement is likes per view.
+DERIVED_METRICS = {
+    'engagement_rate': {
+        'numerator': ['[90 ngày gần đây]Lượt thích'],
+        'denominator': 'Lượt xem',
+        'scale': 100,
+    },
+}
+
+_metric_cache = {}
+
+
+FASTMOSS_NUMERIC_COLUMNS = ['Lượt xem', '[90 ngày gần đây]Lượt thích', 'Lượt theo dõi']
+
+
+def clean_fastmoss_numbers(fastmoss_df):
+    """Copy of the FastMoss frame with Vietnamese-formatted counts converted to numbers"""
+    fastmoss = fastmoss_df.copy()
+    for col in FASTMOSS_NUMERIC_COLUMNS:
+        if col in fastmoss.columns:
+            fastmoss[col] = fastmoss[col].apply(convert_vietnamese_numbers)
+    return fastmoss
+
+
 def process_fastmoss_data(fastmoss_df):
     """Process FastMoss influencer data"""
     if fastmoss_df is None:
         return None, None
 
-    fastmoss = fastmoss_df.copy()
-
-    # Convert numeric columns
-    numeric_columns = ['Lượt xem', '[90 ngày gần đây]Lượt thích', 'Lượt theo dõi']
-    for col in numeric_columns:
-        if col in fastmoss.columns:
-            fastmoss[col] = fastmoss[col].apply(convert_vietnamese_numbers)
+    fastmoss = clean_fastmoss_numbers(fastmoss_df)
 
     # Process timestamps
     if 'Thời gian đăng' in fastmoss.columns:
-        # Extract datetime from Vietnamese format
-        fastmoss['Thời gian đăng'] = pd.to_datetime(
-            fastmoss['Thời gian đăng'].str.extract(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})')[0],
-            errors='coerce'
+        # Parse the Vietnamese format directly; regex extraction only for leftovers
+        fastmoss['Thời gian đăng'], report = parse_datetimes(
+            fastmoss['Thời gian đăng'],
+            extract_pattern=r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})'
         )
+        print(f"Thời gian đăng: {', '.join(report['formats']) or 'no format found'}, "
+              f"{report['failure_rate']:.1%} unparsed")
         fastmoss['hour'] = fastmoss['Thời gian đăng'].dt.hour
 
     # Calculate engagement rate
-    if 'Lượt xem' in fastmoss.columns and '[90 ngày gần đây]Lượt thích' in fastmoss.columns:
-        fastmoss['engagement_rate'] = (fastmoss['[90 ngày gần đây]Lượt thích'] /
-                                       fastmoss['Lượt xem'] * 100).fillna(0)
+    engagement_rate = get_derived_metric(fastmoss, 'engagement_rate',
+                                         DERIVED_METRICS['engagement_rate'], _metric_cache)
+    if engagement_rate is not None:
+        fastmoss['engagement_rate'] = engagement_rate
 
     # Top categories by views
     if 'Phân loại KOC/KOL' in fastmoss.columns:
@@ -141,155 +292,467 @@ def process_fastmoss_data(fastmoss_df):
     return fastmoss, top_categories
 
 
+# Metrics kept sorted for ranked Fanpage Karma profile queries
+KARMA_RANK_METRICS = ['Post interaction rate', 'Engagement', 'Follower']
+KARMA_KEY = ['Profile-ID', 'period_start', 'period_end']
+
+
+def read_karma_export(path):
+    """Read one Fanpage Karma workbook into one row per profile and reporting period.
+
+    The header row is located by its 'Profile' cell instead of a fixed
+    offset, and metrics from other sheets (e.g. Engagement) are merged in
+    by Profile-ID.
+    """
+    sheets = pd.read_excel(path, sheet_name=None, header=None)
+    export_date = None
+    period = (None, None)
+    profiles = None
+
+    for raw in sheets.values():
+        header_rows = raw.index[raw.eq('Profile').any(axis=1)]
+        if len(header_rows) == 0:
+            continue
+        header_row = header_rows[0]
+
+        # Title rows hold the reporting period and the export date
+        for value in raw.iloc[:header_row].stack().dropna().map(str):
+            match = re.fullmatch(r'(\w+ \d+, \d{4}) - (\w+ \d+, \d{4})', value.strip())
+            if match:
+                period = tuple(parse_datetimes(pd.Series(match.groups()))[0])
+            elif re.fullmatch(r'\w+ \d+, \d{4}', value.strip()):
+                export_date = parse_datetimes(pd.Series([value.strip()]))[0].iloc[0]
+
+        sheet = raw.iloc[header_row + 1:].copy()
+        sheet.columns = raw.iloc[header_row].tolist()
+        sheet = sheet.loc[:, sheet.columns.notna()].dropna(subset=['Profile'])
+        if 'Profile-ID' not in sheet.columns:
+            continue
+        sheet['Profile-ID'] = sheet['Profile-ID'].astype(str)
+
+        if profiles is None:
+            profiles = sheet
+        else:
+            extra = [col for col in sheet.columns if col not in profiles.columns]
+            if extra:
+                profiles = profiles.merge(sheet[['Profile-ID'] + extra].drop_duplicates('Profile-ID'),
+                                          on='Profile-ID', how='left')
+
+    if profiles is None:
+        return pd.DataFrame(columns=['Profile', 'Profile-ID'] + KARMA_RANK_METRICS)
+
+    # Karma writes '-' for missing metrics; every column that is otherwise all
+    # numbers becomes numeric, so a reload from the Arrow store keeps its dtype
+    for col in profiles.columns.drop(['Profile', 'Profile-ID']):
+        values = profiles[col].replace(['-', ''], np.nan)
+        numeric = pd.to_numeric(values, errors='coerce')
+        if numeric.notna().sum() == values.notna().sum():
+            profiles[col] = numeric
+    profiles['period_start'], profiles['period_end'] = period
+    profiles['export_date'] = export_date
+    return profiles.reset_index(drop=True)
+
+
+class KarmaProfileTable:
+    """Deduplicated, profile-keyed table merged from many Fanpage Karma exports.
+
+    Rows are unique per (Profile-ID, reporting period); a later export of the
+    same period replaces the earlier one. Row orders sorted by each metric in
+    KARMA_RANK_METRICS are kept so ranked queries never re-sort. Rows of
+    workbooks that were since moved or deleted stay in the table.
+    """
+
+    def __init__(self, table=None):
+        self.table = table if table is not None else pd.DataFrame(
+            columns=['Profile', 'Profile-ID', 'source_file', 'source_mtime'] + KARMA_RANK_METRICS)
+        self.indexes = {}
+        self._build_indexes()
+
+    def _build_indexes(self):
+        self.table = self.table.reset_index(drop=True)
+        for metric in KARMA_RANK_METRICS:
+            if metric in self.table.columns:
+                values = pd.to_numeric(self.table[metric], errors='coerce').to_numpy(dtype=float)
+                # Descending, missing values last
+                self.indexes[metric] = np.lexsort((-np.nan_to_num(values, nan=-np.inf), np.isnan(values)))
+
+    def add_exports(self, paths):
+        """Merge new or changed workbooks and return their paths; unchanged ones are not re-read"""
+        known = dict(zip(self.table['source_file'], self.table['source_mtime']))
+        frames = [self.table]
+        changed = []
+        for path in paths:
+            mtime = os.path.getmtime(path)
+            if known.get(path) == mtime:
+                continue
+            export = read_karma_export(path)
+            export['source_file'] = path
+            export['source_mtime'] = mtime
+            frames.append(export)
+            changed.append(path)
+
+        if not changed:
+            return changed
+        frames[0] = self.table[~self.table['source_file'].isin(changed)]
+        merged = pd.concat([frame for frame in frames if not frame.empty], ignore_index=True)
+        merged = (merged.sort_values('export_date', na_position='first', kind='stable')
+                  .drop_duplicates(KARMA_KEY, keep='last'))
+        self.table = merged
+        self._build_indexes()
+        print(f"Karma profiles: merged {len(changed)} export(s), {self.table['Profile-ID'].nunique()} profiles")
+        return changed
+
+    def top(self, metric='Post interaction rate', n=10, start=None, end=None):
+        """Best n profiles by metric, optionally limited to periods overlapping [start, end]"""
+        if metric not in self.indexes:
+            return self.table.head(0)
+        order = self.indexes[metric]
+        mask = pd.Series(True, index=self.table.index)
+        if start is not None and 'period_end' in self.table.columns:
+            mask &= ~(self.table['period_end'] < pd.Timestamp(start))
+        if end is not None and 'period_start' in self.table.columns:
+            mask &= ~(self.table['period_start'] > pd.Timestamp(end))
+
+        # Walk the presorted order; each profile keeps its best row
+        ranked = self.table.iloc[order[mask.to_numpy()[order]]]
+        return ranked.drop_duplicates('Profile-ID').head(n)
+
+    def profile(self, profile_id):
+        """All reporting periods of one profile"""
+        history = self.table[self.table['Profile-ID'] == str(profile_id)]
+        return history.sort_values('period_start') if 'period_start' in history.columns else history
+
+
+def load_karma_profiles(pattern="[[]FANPAGE KARMA[]]*.xlsx", store_dir=".analytics_store"):
+    """Load the persisted Karma profile table and merge any new or changed exports"""
+    profiles = KarmaProfileTable()
+    if pa is not None and os.path.exists(os.path.join(store_dir, "karma_profiles.arrow")):
+        profiles = KarmaProfileTable(attach_shared_store(store_dir, ['karma_profiles'])['karma_profiles'])
+
+    if profiles.add_exports(sorted(glob.glob(pattern))):
+        write_shared_store({'karma_profiles': profiles.table}, store_dir)
+    return profiles
+
+
+LEADERBOARD_WINDOWS = [7, 30, 90]
+LEADERBOARD_METRICS = ['views', 'videos']
+
+
+class CreatorLeaderboard:
+    """Rolling 7/30/90-day creator totals from FastMoss video rows.
+
+    The initial build takes per-creator cumulative sums of the daily
+    aggregates and differences them at the window edges. After that,
+    add_day() adds the new day's rows and subtracts the days that fall out
+    of each window, so an update costs time proportional to those rows
+    rather than to the whole history.
+    """
+
+    def __init__(self, windows=None):
+        self.windows = windows or LEADERBOARD_WINDOWS
+        self.codes = {}
+        self.ids = []
+        self.names = []
+        self.categories = []
+        self.followers = []
+        self.likes_90d = []
+        self.totals = {window: np.zeros((0, len(LEADERBOARD_METRICS))) for window in self.windows}
+        # (day, creator codes, metric values) in date order, and the first
+        # day still inside each window
+        self.days = []
+        self.window_start = {window: 0 for window in self.windows}
+        self.current_day = None
+
+    def _register(self, rows):
+        """Creator codes for rows, adding new creators and refreshing their snapshots"""
+        ids = rows['ID KOC/KOL'].astype(str)
+        latest = rows.assign(_id=ids).drop_duplicates('_id', keep='last')
+        for record in latest.to_dict('records'):
+            creator = record['_id']
+            fans = record.get('Số Fans', np.nan)
+            likes = record.get('[90 ngày gần đây]Lượt thích', np.nan)
+            if creator not in self.codes:
+                self.codes[creator] = len(self.ids)
+                self.ids.append(creator)
+                self.names.append(record.get('Tên KOC/KOL', creator))
+                self.categories.append(record.get('Phân loại KOC/KOL', ''))
+                self.followers.append(fans)
+                self.likes_90d.append(likes)
+            else:
+                code = self.codes[creator]
+                self.followers[code], self.likes_90d[code] = fans, likes
+        codes = ids.map(self.codes).to_numpy(dtype=np.int64)
+
+        # Grow the running totals for new creators
+        for window, totals in self.totals.items():
+            if len(totals) < len(self.ids):
+                grown = np.zeros((len(self.ids), totals.shape[1]))
+                grown[:len(totals)] = totals
+                self.totals[window] = grown
+        return codes
+
+    @staticmethod
+    def _metric_values(rows):
+        views = pd.to_numeric(rows['Lượt xem'], errors='coerce').fillna(0).to_numpy(dtype=float)
+        return np.column_stack([views, np.ones(len(rows))])
+
+    @classmethod
+    def from_frame(cls, fastmoss, windows=None):
+        """Build leaderboards as of the latest day in a processed FastMoss frame"""
+        board = cls(windows)
+        rows = fastmoss.dropna(subset=['Thời gian đăng', 'ID KOC/KOL'])
+        if rows.empty:
+            return board
+        rows = rows.assign(day=rows['Thời gian đăng'].dt.normalize()).sort_values('day', kind='stable')
+
+        codes = board._register(rows)
+        values = board._metric_values(rows)
+        days = rows['day'].to_numpy()
+
+        # Daily aggregates per creator, then cumulative sums along time
+        daily = (pd.DataFrame(values, columns=LEADERBOARD_METRICS)
+                 .assign(creator=codes, day=days)
+                 .groupby(['creator', 'day'], sort=True).sum())
+        cumulative = daily.groupby(level='creator').cumsum()
+        board.current_day = days[-1]
+
+        for window in board.windows:
+            edge = board.current_day - np.timedelta64(window, 'D')
+            at_end = cumulative.groupby(level='creator').last()
+            before = cumulative[cumulative.index.get_level_values('day') <= edge]
+            at_edge = before.groupby(level='creator').last().reindex(at_end.index, fill_value=0)
+            board.totals[window][at_end.index.to_numpy()] = (at_end - at_edge).to_numpy()
+
+        # Keep per-day rows so later days can expire them from the windows
+        unique_days, starts = np.unique(days, return_index=True)
+        for day, start, end in zip(unique_days, starts, list(starts[1:]) + [len(days)]):
+            board.days.append((day, codes[start:end], values[start:end]))
+        for window in board.windows:
+            edge = board.current_day - np.timedelta64(window, 'D')
+            board.window_start[window] = int(np.searchsorted(unique_days, edge, side='right'))
+        board._trim_days()
+        return board
+
+    def _trim_days(self):
+        """Drop days that have left every window and shift the window offsets"""
+        expired = min(self.window_start.values())
+        if expired:
+            del self.days[:expired]
+            for window in self.windows:
+                self.window_start[window] -= expired
+
+    def add_day(self, day, rows):
+        """Add one new day of video rows and slide every window forward"""
+        day = np.datetime64(pd.Timestamp(day).normalize())
+        if self.current_day is not None and day <= self.current_day:
+            raise ValueError(f"Days must be added in order: {day} <= {self.current_day}")
+
+        codes = self._register(rows)
+        values = self._metric_values(rows)
+        self.days.append((day, codes, values))
+        self.current_day = day
+
+        for window in self.windows:
+            np.add.at(self.totals[window], codes, values)
+            edge = day - np.timedelta64(window, 'D')
+            while self.days[self.window_start[window]][0] <= edge:
+                _, old_codes, old_values = self.days[self.window_start[window]]
+                np.subtract.at(self.totals[window], old_codes, old_values)
+                self.window_start[window] += 1
+        self._trim_days()
+        return self
+
+    def leaderboard(self, window=30, metric='views', category=None, n=10):
+        """Top n creators by a rolling-window total, optionally within one KOL category"""
+        totals = self.totals[window][:, LEADERBOARD_METRICS.index(metric)]
+        candidates = np.arange(len(totals))
+        if category is not None:
+            candidates = candidates[np.asarray(self.categories, dtype=object) == category]
+        candidates = candidates[totals[candidates] > 0]
+
+        # Partial selection, then order only the winners
+        if len(candidates) > n:
+            candidates = candidates[np.argpartition(-totals[candidates], n - 1)[:n]]
+        candidates = candidates[np.argsort(-totals[candidates], kind='stable')]
+
+        return pd.DataFrame({
+            'ID KOC/KOL': np.asarray(self.ids, dtype=object)[candidates],
+            'Tên KOC/KOL': np.asarray(self.names, dtype=object)[candidates],
+            'Phân loại KOC/KOL': np.asarray(self.categories, dtype=object)[candidates],
+            f'{window}d views': self.totals[window][candidates, 0],
+            f'{window}d videos': self.totals[window][candidates, 1].astype(int),
+            'Số Fans': np.asarray(self.followers, dtype=object)[candidates],
+            '[90 ngày gần đây]Lượt thích': np.asarray(self.likes_90d, dtype=object)[candidates],
+        })
+
+    def leaderboards(self, metric='views', n=10):
+        """Leaderboards for every window, overall and per KOL category"""
+        boards = {}
+        for window in self.windows:
+            boards[(window, None)] = self.leaderboard(window, metric, n=n)
+            for category in sorted(set(self.categories), key=str):
+                boards[(window, category)] = self.leaderboard(window, metric, category, n)
+        return boards
+
+
 def process_fanpage_data(fanpage):
     """Process Fanpage Karma data"""
     if fanpage is None:
         return None
 
-    # Clean interaction rate column
-    if 'Post interaction rate' in fanpage.columns:
-        fanpage['Post interaction rate'] = pd.to_numeric(
-            fanpage['Post interaction rate'], errors='coerce'
-        )
-        top_fanpages = (fanpage.sort_values(by='Post interaction rate', ascending=False)
-                        .head(10))
-    else:
-        print("Available columns:", fanpage.columns.tolist())
-        top_fanpages = fanpage.head(10)
-
-    return top_fanpages
-
-
-def create_enhanced_visualizations(apify, top_hashtags, post_by_hour, posts_by_day,
-                                   fastmoss, top_categories, top_fanpages):
-    """Create comprehensive visualizations"""
-
-    # Set up the figure with subplots
-    fig = plt.figure(figsize=(20, 16))
+    if isinstance(fanpage, pd.DataFrame):
+        if 'Profile-ID' not in fanpage.columns:
+            print("Available columns:", fanpage.columns.tolist())
+            return fanpage.head(10)
+        fanpage = KarmaProfileTable(fanpage)
+
+    # Ranked from the presorted interaction-rate index
+    return fanpage.top('Post interaction rate', 10)
+
+
+# Panels of the 20x16 dashboard: (name, left, bottom, width, height) as figure fractions
+DASHBOARD_SIZE = (20, 16)
+DASHBOARD_PANELS = [
+    ('posts_by_hour', 0, 2 / 3, 1 / 3, 1 / 3),
+    ('top_hashtags', 1 / 3, 2 / 3, 1 / 3, 1 / 3),
+    ('posts_by_weekday', 2 / 3, 2 / 3, 1 / 3, 1 / 3),
+    ('kol_categories', 0, 1 / 3, 1 / 2, 1 / 3),
+    ('fanpages', 1 / 2, 1 / 3, 1 / 2, 1 / 3),
+    ('engagement_histogram', 0, 0, 1 / 2, 1 / 3),
+    ('summary', 1 / 2, 0, 1 / 2, 1 / 3),
+]
+# Bump when panel drawing code changes so cached images are redrawn
+DASHBOARD_CACHE_VERSION = 1
+
+# Latest (key, image) per panel name; older renders are evicted
+_panel_cache = {}
+
+
+def content_hash(*parts):
+    """Hash panel inputs (Series, DataFrames or plain values) into a short key"""
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, (pd.Series, pd.DataFrame)):
+            digest.update(pd.util.hash_pandas_object(part, index=True).to_numpy().tobytes())
+            names = part.columns.tolist() if isinstance(part, pd.DataFrame) else part.name
+            digest.update(repr(names).encode())
+        else:
+            digest.update(repr(part).encode())
+    return digest.hexdigest()[:16]
+
+
+def format_compact(value):
+    """Format large numbers as 1.2M / 3.4K"""
+    if value >= 1_000_000:
+        return f'{value / 1_000_000:.1f}M'
+    elif value >= 1_000:
+        return f'{value / 1_000:.1f}K'
+    return f'{int(value)}'
+
+
+def draw_posts_by_hour(ax, post_by_hour):
+    bars = ax.bar(post_by_hour.index, post_by_hour.values,
+                  color=plt.cm.viridis(np.linspace(0, 1, len(post_by_hour))))
+    ax.set_title("📱 TikTok Posts by Hour", fontsize=12, fontweight='bold')
+    ax.set_xlabel("Hour of Day")
+    ax.set_ylabel("Number of Posts")
+    ax.set_xticks(range(0, 24, 2))
+    ax.bar_label(bars, labels=[f'{int(v)}' for v in post_by_hour.values], fontsize=8)
+
+
+def draw_top_hashtags(ax, top_hashtags):
+    colors = plt.cm.magma(np.linspace(0.2, 0.8, len(top_hashtags)))
+    bars = ax.barh(range(len(top_hashtags)), top_hashtags.values, color=colors)
+    ax.set_title("🔥 Top Trending Hashtags", fontsize=12, fontweight='bold')
+    ax.set_xlabel("Frequency")
+    ax.set_ylabel("Hashtag")
+    ax.set_yticks(range(len(top_hashtags)), [f"#{tag}" for tag in top_hashtags.index])
+    ax.bar_label(bars, labels=[f'{v}' for v in top_hashtags.values], padding=2, fontsize=8)
+
+
+def draw_posts_by_weekday(ax, posts_by_day):
+    day_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+    posts_by_day_ordered = posts_by_day.reindex(day_order, fill_value=0)
+    colors = plt.cm.Set3(np.linspace(0, 1, 7))
+    bars = ax.bar(range(7), posts_by_day_ordered.values, color=colors)
+    ax.set_title("📅 Posts by Day of Week", fontsize=12, fontweight='bold')
+    ax.set_xlabel("Day")
+    ax.set_ylabel("Number of Posts")
+    ax.set_xticks(range(7), [day[:3] for day in day_order], rotation=45)
+    ax.bar_label(bars, labels=[f'{int(v)}' for v in posts_by_day_ordered.values], fontsize=8)
+
+
+def draw_kol_categories(ax, top_categories):
+    colors = plt.cm.coolwarm(np.linspace(0.2, 0.8, len(top_categories)))
+    bars = ax.barh(range(len(top_categories)), top_categories.values, color=colors)
+    ax.set_title("👑 KOL Categories by Avg Views", fontsize=12, fontweight='bold')
+    ax.set_xlabel("Average Views")
+    ax.set_ylabel("Category")
+    ax.set_yticks(range(len(top_categories)), top_categories.index)
+    ax.bar_label(bars, labels=[format_compact(v) for v in top_categories.values],
+                 padding=2, fontsize=8)
+
+
+def draw_fanpages(ax, fanpages):
+    rates = fanpages['Post interaction rate'].fillna(0)
+    colors = sns.color_palette("crest", n_colors=len(fanpages))
+    bars = ax.barh(range(len(fanpages)), rates, color=colors)
+    ax.set_title("📊 Top Fanpages by Interaction Rate", fontsize=12, fontweight='bold')
+    ax.set_xlabel("Interaction Rate (%)")
+    ax.set_ylabel("Fanpage")
+    ax.set_yticks(range(len(fanpages)),
+                  [name[:20] + "..." if len(str(name)) > 20 else str(name)
+                   for name in fanpages['Profile']])
+    ax.bar_label(bars, labels=[f'{v:.1f}%' for v in rates], padding=2, fontsize=8)
+
+
+def draw_engagement_histogram(ax, engagement_data):
+    ax.hist(engagement_data, bins=20, alpha=0.7, color='skyblue', edgecolor='black')
+    ax.set_title("💫 Engagement Rate Distribution", fontsize=12, fontweight='bold')
+    ax.set_xlabel("Engagement Rate (%)")
+    ax.set_ylabel("Frequency")
+    ax.axvline(engagement_data.mean(), color='red', linestyle='--',
+               label=f'Mean: {engagement_data.mean():.1f}%')
+    ax.legend()
+
+
+def draw_summary(ax, summary_text):
+    ax.axis('off')
+    ax.text(0.05, 0.95, summary_text, transform=ax.transAxes,
+            fontsize=10, verticalalignment='top', fontfamily='monospace',
+            bbox=dict(boxstyle="round,pad=0.5", facecolor="lightgray", alpha=0.8))
+
+
+def build_summary_text(apify, top_hashtags, post_by_hour, fastmoss, top_categories, top_fanpages,
+                       estimates=None):
+    """Build the campaign summary shown in the last dashboard panel"""
+    summary_text = "📈 CAMPAIGN SUMMARY\n\n"
 
-    # 1. Post frequency by hour (TikTok)
-    plt.subplot(3, 3, 1)
-    if post_by_hour is not None and not post_by_hour.empty:
-        bars = plt.bar(post_by_hour.index, post_by_hour.values,
-                       color=plt.cm.viridis(np.linspace(0, 1, len(post_by_hour))))
-        plt.title("📱 TikTok Posts by Hour", fontsize=12, fontweight='bold')
-        plt.xlabel("Hour of Day")
-        plt.ylabel("Number of Posts")
-        plt.xticks(range(0, 24, 2))
-
-        # Add value labels on bars
-        for bar in bars:
-            height = bar.get_height()
-            plt.text(bar.get_x() + bar.get_width() / 2., height + 0.1,
-                     f'{int(height)}', ha='center', va='bottom', fontsize=8)
-
-    # 2. Top hashtags
-    plt.subplot(3, 3, 2)
-    if top_hashtags is not None and not top_hashtags.empty:
-        colors = plt.cm.magma(np.linspace(0.2, 0.8, len(top_hashtags)))
-        bars = plt.barh(range(len(top_hashtags)), top_hashtags.values, color=colors)
-        plt.title("🔥 Top Trending Hashtags", fontsize=12, fontweight='bold')
-        plt.xlabel("Frequency")
-        plt.ylabel("Hashtag")
-        plt.yticks(range(len(top_hashtags)), [f"#{tag}" for tag in top_hashtags.index])
-
-        # Add value labels
-        for i, (bar, value) in enumerate(zip(bars, top_hashtags.values)):
-            plt.text(value + max(top_hashtags.values) * 0.01, i,
-                     f'{value}', va='center', fontsize=8)
-
-    # 3. Posts by day of week
-    plt.subplot(3, 3, 3)
-    if posts_by_day is not None and not posts_by_day.empty:
-        day_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-        posts_by_day_ordered = posts_by_day.reindex(day_order, fill_value=0)
-        colors = plt.cm.Set3(np.linspace(0, 1, 7))
-        bars = plt.bar(range(7), posts_by_day_ordered.values, color=colors)
-        plt.title("📅 Posts by Day of Week", fontsize=12, fontweight='bold')
-        plt.xlabel("Day")
-        plt.ylabel("Number of Posts")
-        plt.xticks(range(7), [day[:3] for day in day_order], rotation=45)
-
-        # Add value labels
-        for bar in bars:
-            height = bar.get_height()
-            plt.text(bar.get_x() + bar.get_width() / 2., height + 0.1,
-                     f'{int(height)}', ha='center', va='bottom', fontsize=8)
-
-    # 4. KOL Categories by average views
-    plt.subplot(3, 2, 3)
-    if top_categories is not None and not top_categories.empty:
-        colors = plt.cm.coolwarm(np.linspace(0.2, 0.8, len(top_categories)))
-        bars = plt.barh(range(len(top_categories)), top_categories.values, color=colors)
-        plt.title("👑 KOL Categories by Avg Views", fontsize=12, fontweight='bold')
-        plt.xlabel("Average Views")
-        plt.ylabel("Category")
-        plt.yticks(range(len(top_categories)), top_categories.index)
-
-        # Format large numbers
-        for i, (bar, value) in enumerate(zip(bars, top_categories.values)):
-            if value >= 1_000_000:
-                label = f'{value / 1_000_000:.1f}M'
-            elif value >= 1_000:
-                label = f'{value / 1_000:.1f}K'
-            else:
-                label = f'{int(value)}'
-            plt.text(value + max(top_categories.values) * 0.01, i,
-                     label, va='center', fontsize=8)
+    if estimates:
+        summary_text += "⚡ PREVIEW (stratified sample, 95% CI)\n"
+        for label, estimate in estimates.items():
+            summary_text += (f"{label}: {format_compact(estimate['estimate'])} "
+                             f"({format_compact(max(estimate['ci_low'], 0))}-"
+                             f"{format_compact(estimate['ci_high'])})\n")
+        summary_text += "\n"
 
-    # 5. Top fanpages by interaction rate
-    plt.subplot(3, 2, 4)
-    if top_fanpages is not None and len(top_fanpages) > 0:
-        if 'Post interaction rate' in top_fanpages.columns and 'Profile' in top_fanpages.columns:
-            colors = sns.color_palette("crest", n_colors=len(top_fanpages))
-            bars = plt.barh(range(len(top_fanpages)),
-                            top_fanpages['Post interaction rate'].fillna(0), color=colors)
-            plt.title("📊 Top Fanpages by Interaction Rate", fontsize=12, fontweight='bold')
-            plt.xlabel("Interaction Rate (%)")
-            plt.ylabel("Fanpage")
-            plt.yticks(range(len(top_fanpages)),
-                       [name[:20] + "..." if len(str(name)) > 20 else str(name)
-                        for name in top_fanpages['Profile']])
-
-            # Add value labels
-            for i, (bar, value) in enumerate(zip(bars, top_fanpages['Post interaction rate'].fillna(0))):
-                plt.text(value + max(top_fanpages['Post interaction rate'].fillna(0)) * 0.01, i,
-                         f'{value:.1f}%', va='center', fontsize=8)
-
-    # 6. Engagement rate distribution (FastMoss)
-    plt.subplot(3, 2, 5)
-    if fastmoss is not None and 'engagement_rate' in fastmoss.columns:
-        engagement_data = fastmoss['engagement_rate'].dropna()
-        if not engagement_data.empty:
-            plt.hist(engagement_data, bins=20, alpha=0.7, color='skyblue', edgecolor='black')
-            plt.title("💫 Engagement Rate Distribution", fontsize=12, fontweight='bold')
-            plt.xlabel("Engagement Rate (%)")
-            plt.ylabel("Frequency")
-            plt.axvline(engagement_data.mean(), color='red', linestyle='--',
-                        label=f'Mean: {engagement_data.mean():.1f}%')
-            plt.legend()
-
-    # 7. Summary statistics
-    plt.subplot(3, 2, 6)
-    plt.axis('off')
-
-    # Create summary text
-    summary_text = "📈 CAMPAIGN SUMMARY\n\n"
+    # Counts and sums below cover only the sample when previewing
+    scope = " (sample)" if estimates else ""
 
     if apify is not None:
-        summary_text += f"🎬 TikTok Posts: {len(apify):,}\n"
+        summary_text += f"🎬 TikTok Posts{scope}: {len(apify):,}\n"
         if 'timestamp' in apify.columns:
             date_range = f"{apify['timestamp'].min().strftime('%Y-%m-%d')} to {apify['timestamp'].max().strftime('%Y-%m-%d')}"
             summary_text += f"📅 Date Range: {date_range}\n"
 
     if fastmoss is not None:
-        summary_text += f"👥 Influencers: {len(fastmoss):,}\n"
+        summary_text += f"👥 Influencers{scope}: {len(fastmoss):,}\n"
         if 'Lượt xem' in fastmoss.columns:
             total_views = fastmoss['Lượt xem'].sum()
             if total_views >= 1_000_000:
-                summary_text += f"👀 Total Views: {total_views / 1_000_000:.1f}M\n"
+                summary_text += f"👀 Total Views{scope}: {total_views / 1_000_000:.1f}M\n"
             else:
-                summary_text += f"👀 Total Views: {total_views:,.0f}\n"
+                summary_text += f"👀 Total Views{scope}: {total_views:,.0f}\n"
 
     if top_fanpages is not None and len(top_fanpages) > 0:
         summary_text += f"📱 Top Fanpages: {len(top_fanpages)}\n"
@@ -312,18 +775,89 @@ def create_enhanced_visualizations(apify, top_hashtags, post_by_hour, posts_by_d
         best_category = top_categories.index[0]
         summary_text += f"👑 Best KOL category: {best_category}\n"
 
-    plt.text(0.05, 0.95, summary_text, transform=plt.gca().transAxes,
-             fontsize=10, verticalalignment='top', fontfamily='monospace',
-             bbox=dict(boxstyle="round,pad=0.5", facecolor="lightgray", alpha=0.8))
+    return summary_text
+
+
+def render_panel(name, draw, data, size, cache_dir=".dashboard_cache", dpi=100):
+    """Render one dashboard panel to an image, reusing the cached image if its input is unchanged"""
+    key = f"{name}-{content_hash(data, size, dpi, DASHBOARD_CACHE_VERSION)}"
+    cached = _panel_cache.get(name)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    path = os.path.join(cache_dir, f"{key}.png") if cache_dir else None
+    if path:
+        # Only the latest image of each panel is kept on disk
+        for stale in glob.glob(os.path.join(cache_dir, f"{glob.escape(name)}-*.png")):
+            if stale != path:
+                os.remove(stale)
+
+    if path and os.path.exists(path):
+        image = plt.imread(path)
+    else:
+        fig, ax = plt.subplots(figsize=size, dpi=dpi)
+        if data is None:
+            ax.axis('off')
+        else:
+            draw(ax, data)
+        fig.tight_layout(pad=1.5)
+        fig.canvas.draw()
+        image = np.asarray(fig.canvas.buffer_rgba()).copy()
+        plt.close(fig)
+        if path:
+            os.makedirs(cache_dir, exist_ok=True)
+            plt.imsave(path, image)
+
+    _panel_cache[name] = (key, image)
+    return image
+
+
+def create_enhanced_visualizations(apify, top_hashtags, post_by_hour, posts_by_day,
+                                   fastmoss, top_categories, top_fanpages,
+                                   cache_dir=".dashboard_cache", estimates=None):
+    """Create comprehensive visualizations from cached per-panel images"""
+
+    # Input of each panel; None leaves the panel blank
+    engagement_data = None
+    if fastmoss is not None and 'engagement_rate' in fastmoss.columns:
+        engagement_data = fastmoss['engagement_rate'].dropna()
+
+    fanpages = None
+    if (top_fanpages is not None and len(top_fanpages) > 0 and
+            'Post interaction rate' in top_fanpages.columns and 'Profile' in top_fanpages.columns):
+        fanpages = top_fanpages[['Profile', 'Post interaction rate']]
+
+    panel_inputs = {
+        'posts_by_hour': (draw_posts_by_hour, post_by_hour),
+        'top_hashtags': (draw_top_hashtags, top_hashtags),
+        'posts_by_weekday': (draw_posts_by_weekday, posts_by_day),
+        'kol_categories': (draw_kol_categories, top_categories),
+        'fanpages': (draw_fanpages, fanpages),
+        'engagement_histogram': (draw_engagement_histogram, engagement_data),
+        'summary': (draw_summary, build_summary_text(apify, top_hashtags, post_by_hour, fastmoss,
+                                                     top_categories, top_fanpages, estimates)),
+    }
+
+    # Compose the dashboard from panel images
+    fig = plt.figure(figsize=DASHBOARD_SIZE)
+    for name, left, bottom, width, height in DASHBOARD_PANELS:
+        draw, data = panel_inputs[name]
+        if isinstance(data, (pd.Series, pd.DataFrame)) and data.empty:
+            data = None
+        size = (DASHBOARD_SIZE[0] * width, DASHBOARD_SIZE[1] * height * 0.96)
+        image = render_panel(name, draw, data, size, cache_dir=cache_dir)
+
+        ax = fig.add_axes([left, bottom, width, height * 0.96])
+        ax.imshow(image, interpolation='antialiased')
+        ax.axis('off')
 
-    plt.tight_layout(pad=3.0)
     plt.suptitle("🌱 CỎ MỀM - Social Media Analytics Dashboard",
-                 fontsize=16, fontweight='bold', y=0.98)
+                 fontsize=16, fontweight='bold', y=0.995)
 
     return fig
 
 
-def main():
+def main(parallel=False, preview=False):
     """Main execution function"""
     print("🌱 Starting Cỏ Mềm Social Media Analytics...")
 
@@ -334,19 +868,51 @@ def main():
         print("❌ No data could be loaded. Please check your file paths.")
         return
 
+    designs = {}
+    if preview:
+        print("\n⚡ Preview mode: stratified sample by week and KOL category")
+        apify, fastmoss_df, designs = sample_for_preview(apify, fastmoss_df)
+
     # Process each data source
     print("\n📊 Processing data...")
 
-    apify_processed, top_hashtags, post_by_hour, posts_by_day = process_apify_data(apify)
-    fastmoss_processed, top_categories = process_fastmoss_data(fastmoss_df)
-    top_fanpages = process_fanpage_data(fanpage)
+    if parallel:
+        apify_results, fastmoss_results, top_fanpages = process_data_parallel(
+            apify, fastmoss_df, fanpage)
+    else:
+        apify_results = process_apify_data(apify)
+        fastmoss_results = process_fastmoss_data(fastmoss_df)
+        top_fanpages = process_fanpage_data(fanpage)
+
+    apify_processed, top_hashtags, post_by_hour, posts_by_day = apify_results
+    fastmoss_processed, top_categories = fastmoss_results
+
+    # Rolling creator leaderboards (window totals are meaningless on a sample)
+    if preview:
+        print("\n👑 Creator leaderboards skipped in preview mode")
+    elif (fastmoss_processed is not None and 'ID KOC/KOL' in fastmoss_processed.columns and
+            'Thời gian đăng' in fastmoss_processed.columns):
+        leaderboard = CreatorLeaderboard.from_frame(fastmoss_processed)
+        print("\n👑 Top creators by views, last 30 days:")
+        print(leaderboard.leaderboard(30, n=5)[['Tên KOC/KOL', 'Phân loại KOC/KOL', '30d views']]
+              .to_string(index=False))
+
+    # Extrapolate totals from the sample
+    estimates = {}
+    if 'apify' in designs:
+        estimates['TikTok views'] = estimate_total(apify_processed['playCount'], designs['apify'])
+    if 'fastmoss' in designs and 'Lượt xem' in fastmoss_processed.columns:
+        estimates['KOL views'] = estimate_total(fastmoss_processed['Lượt xem'], designs['fastmoss'])
+    for label, estimate in estimates.items():
+        print(f"{label}: {estimate['estimate']:,.0f} "
+              f"(95% CI {estimate['ci_low']:,.0f} to {estimate['ci_high']:,.0f})")
 
     # Create visualizations
     print("\n🎨 Creating visualizations...")
 
     fig = create_enhanced_visualizations(
         apify_processed, top_hashtags, post_by_hour, posts_by_day,
-        fastmoss_processed, top_categories, top_fanpages
+        fastmoss_processed, top_categories, top_fanpages, estimates=estimates
     )
 
     plt.show()
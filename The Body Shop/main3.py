@@ -1,10 +1,33 @@
 import pandas as pd
 import matplotlib.pyplot as plt
-import seaborn as sns
 import numpy as np
+import os
+import pickle
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 import warnings
 
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# Helpers shared by the brand scripts live next to the brand folders
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from analytics_helpers import (
+    estimate_total, get_derived_metric, load_apify_dataset, parse_datetimes,
+    preview_strata, stratified_sample, to_arrow_table,
+)
+
 warnings.filterwarnings('ignore')
 
 # Set Vietnamese locale for matplotlib
@@ -12,7 +35,369 @@ plt.rcParams['font.sans-serif'] = ['DejaVu Sans', 'Arial Unicode MS', 'Tahoma']
 plt.style.use('seaborn-v0_8')
 
 
+# Derived ratio metrics: summed numerator columns over a denominator column
+DERIVED_METRICS = {
+    'engagement_rate': {
+        'numerator': ['diggCount', 'shareCount', 'commentCount'],
+        'denominator': 'playCount',
+        'scale': 100,
+        'round': 2,
+    },
+    'revenue_per_view': {
+        'numerator': ['Doanh số (VND)'],
+        'denominator': 'Lượt xem',
+        'scale': 1,
+    },
+}
+
+
+def bootstrap_bucket_means(values, buckets, n_resamples=10000, confidence=0.95,
+                           max_blocks=256, seed=None):
+    """Bootstrap confidence intervals for the mean of every bucket at once.
+
+    Rows of each bucket are shuffled into at most ``max_blocks`` blocks and
+    the block sums are resampled, so a resample costs O(blocks) instead of
+    O(rows). Buckets with no more rows than ``max_blocks`` are resampled row
+    by row, which is the plain bootstrap. All resamples for all buckets come
+    from one batched uniform draw per chunk of resamples.
+    """
+    frame = pd.DataFrame({'value': pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(),
+                          'bucket': pd.Series(buckets).to_numpy()}).dropna()
+    if frame.empty:
+        return pd.DataFrame(columns=['mean', 'ci_low', 'ci_high', 'count'])
+
+    rng = np.random.default_rng(seed)
+    codes, labels = pd.factorize(frame['bucket'], sort=True)
+    value_array = frame['value'].to_numpy(dtype=float)
+
+    # Shuffle rows, then group them by bucket so blocks are random subsets
+    order = rng.permutation(len(codes))
+    order = order[np.argsort(codes[order], kind='stable')]
+    codes, value_array = codes[order], value_array[order]
+
+    counts = np.bincount(codes, minlength=len(labels))
+    n_blocks = np.minimum(counts, max_blocks)
+    row_starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    block_starts = np.concatenate([[0], np.cumsum(n_blocks)[:-1]])
+
+    # Rank of each row within its bucket decides its block
+    rank = np.arange(len(codes)) - row_starts[codes]
+    block_ids = block_starts[codes] + rank * n_blocks[codes] // counts[codes]
+    block_sums = np.bincount(block_ids, weights=value_array, minlength=n_blocks.sum())
+    block_sizes = np.bincount(block_ids, minlength=n_blocks.sum()).astype(float)
+
+    # Every resample draws n_blocks[k] blocks with replacement from bucket k
+    draw_offset = np.repeat(block_starts, n_blocks)
+    draw_range = np.repeat(n_blocks, n_blocks)
+    draw_limit = (draw_range - 1).astype(np.int32)
+    draw_range = draw_range.astype(np.float32)
+
+    means = np.empty((n_resamples, len(labels)))
+    chunk = max(1, int(2e7 // max(len(draw_offset), 1)))
+    for start in range(0, n_resamples, chunk):
+        size = min(chunk, n_resamples - start)
+        picks = (rng.random((size, len(draw_offset)), dtype=np.float32) * draw_range).astype(np.int32)
+        # float32 rounding can land exactly on the upper bound
+        np.minimum(picks, draw_limit, out=picks)
+        picks += draw_offset.astype(np.int32)
+        sums = np.add.reduceat(block_sums[picks], block_starts, axis=1)
+        sizes = np.add.reduceat(block_sizes[picks], block_starts, axis=1)
+        means[start:start + size] = sums / sizes
+
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(means, [alpha, 1 - alpha], axis=0)
+    return pd.DataFrame({
+        'mean': np.bincount(codes, weights=value_array) / counts,
+        'ci_low': low,
+        'ci_high': high,
+        'count': counts,
+    }, index=pd.Index(labels, name='bucket'))
+
+
+def separated_winner(intervals, min_count=5):
+    """Return the bucket whose CI lies entirely above every other bucket's CI, if any.
+
+    Buckets with fewer than ``min_count`` rows have degenerate intervals and
+    are left out of the comparison.
+    """
+    intervals = intervals[intervals['count'] >= min_count]
+    if len(intervals) < 2:
+        return None
+    best = intervals['mean'].idxmax()
+    others = intervals.drop(index=best)
+    if intervals.loc[best, 'ci_low'] > others['ci_high'].max():
+        return best
+    return None
+
+
+def minmax_downsample(x, y, n_buckets):
+    """Keep the first, last, minimum and maximum point of each bucket along x.
+
+    Buckets are equal-width in x, so with one bucket per pixel column the
+    drawn line looks the same as the full series and every peak is kept.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=float)
+    if len(x) <= 4 * n_buckets:
+        return x, y
+
+    position = x.astype('datetime64[ns]').astype(np.int64) if np.issubdtype(x.dtype, np.datetime64) \
+        else x.astype(float)
+    # Float offsets: nanosecond offsets times n_buckets overflow int64 past ~100 days
+    offset = (position - position[0]).astype(float)
+    span = max(offset[-1], 1.0)
+    buckets = np.minimum((offset / span * n_buckets).astype(np.int64), n_buckets - 1)
+
+    grouped = pd.Series(y).groupby(buckets)
+    row = pd.Series(np.arange(len(y))).groupby(buckets)
+    keep = np.unique(np.concatenate([
+        grouped.idxmin().to_numpy(), grouped.idxmax().to_numpy(),
+        row.first().to_numpy(), row.last().to_numpy(),
+    ]))
+    return x[keep], y[keep]
+
+
+# Caption columns and the metrics aggregated for keyword searches, per source
+CAPTION_SOURCES = {
+    'apify': {
+        'text': ['desc', 'text'],
+        'views': 'playCount',
+        'interactions': ['diggCount', 'shareCount', 'commentCount'],
+    },
+    'fastmoss_video': {
+        'text': ['Tiêu đề video', 'Tiêu đề Video'],
+        'views': 'Lượt xem',
+        'interactions': ['Số lượng likes'],
+    },
+}
+
+
+def frame_fingerprint(df):
+    """Content hash of a frame, used to tell whether derived files are stale"""
+    return str(int(pd.util.hash_pandas_object(df, index=False).sum()))
+
+
+def normalize_vietnamese(texts):
+    """Lowercase captions and strip Vietnamese diacritics ('Dưỡng ẩm' -> 'duong am')"""
+    texts = pd.Series(texts, dtype=object).fillna('').astype(str).str.lower()
+    texts = texts.str.replace('đ', 'd', regex=False).str.normalize('NFD')
+    return texts.str.replace('[\u0300-\u036f]', '', regex=True)
+
+
+class CaptionIndex:
+    """Inverted index from caption tokens and n-grams to row positions.
+
+    Posting lists are stored as one sorted int32 array plus per-term offsets.
+    Phrases longer than ``ngram`` tokens are matched by intersecting their
+    n-gram postings and then checking the normalized caption text.
+    """
+
+    def __init__(self, ngram=2):
+        self.ngram = ngram
+        self.terms = {}
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.postings = np.zeros(0, dtype=np.int32)
+        self.views = np.zeros(0)
+        self.interactions = np.zeros(0)
+        self.text_bytes = b''
+        self.text_offsets = np.zeros(1, dtype=np.int64)
+        self.fingerprint = ''
+
+    @classmethod
+    def build(cls, captions, views, interactions, ngram=2):
+        index = cls(ngram)
+        normalized = normalize_vietnamese(captions).reset_index(drop=True)
+
+        tokens = normalized.str.findall(r'[0-9a-z]+').explode().dropna()
+        tokens = pd.DataFrame({'row': tokens.index.to_numpy(dtype=np.int32),
+                               'term': tokens.to_numpy(dtype=object)})
+
+        # n-grams join each token with the following ones of the same caption
+        grams = [tokens]
+        joined = tokens['term']
+        for n in range(2, ngram + 1):
+            following = tokens['term'].shift(-(n - 1))
+            same_row = tokens['row'].shift(-(n - 1)) == tokens['row']
+            joined = joined + ' ' + following.where(same_row, '')
+            grams.append(pd.DataFrame({'row': tokens['row'], 'term': joined})[same_row])
+        pairs = pd.concat(grams, ignore_index=True).drop_duplicates().sort_values(['term', 'row'])
+
+        codes, terms = pd.factorize(pairs['term'], sort=True)
+        index.terms = {term: i for i, term in enumerate(terms)}
+        index.offsets = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(terms)))])
+        index.postings = pairs['row'].to_numpy(dtype=np.int32)
+
+        index.views = pd.to_numeric(pd.Series(views), errors='coerce').fillna(0).to_numpy(dtype=float)
+        index.interactions = pd.to_numeric(pd.Series(interactions), errors='coerce').fillna(0).to_numpy(dtype=float)
+
+        encoded = [text.encode('utf-8') for text in normalized]
+        index.text_bytes = b''.join(encoded)
+        index.text_offsets = np.concatenate([[0], np.cumsum([len(text) for text in encoded])])
+        return index
+
+    def save(self, path):
+        terms = sorted(self.terms, key=self.terms.get)
+        np.savez(path, ngram=self.ngram, fingerprint=self.fingerprint,
+                 terms=np.array(terms, dtype=str), offsets=self.offsets, postings=self.postings,
+                 views=self.views, interactions=self.interactions,
+                 text_bytes=np.frombuffer(self.text_bytes, dtype=np.uint8),
+                 text_offsets=self.text_offsets)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        index = cls(int(data['ngram']))
+        index.fingerprint = str(data['fingerprint'])
+        index.terms = {term: i for i, term in enumerate(data['terms'].tolist())}
+        index.offsets = data['offsets']
+        index.postings = data['postings']
+        index.views = data['views']
+        index.interactions = data['interactions']
+        index.text_bytes = data['text_bytes'].tobytes()
+        index.text_offsets = data['text_offsets']
+        return index
+
+    def _posting(self, term):
+        position = self.terms.get(term)
+        if position is None:
+            return np.zeros(0, dtype=np.int32)
+        return self.postings[self.offsets[position]:self.offsets[position + 1]]
+
+    def lookup(self, phrase):
+        """Return the sorted row positions whose caption contains the phrase"""
+        tokens = re.findall(r'[0-9a-z]+', normalize_vietnamese([phrase]).iloc[0])
+        if not tokens:
+            return np.zeros(0, dtype=np.int32)
+        if len(tokens) <= self.ngram:
+            return self._posting(' '.join(tokens))
+
+        rows = None
+        for start in range(len(tokens) - self.ngram + 1):
+            posting = self._posting(' '.join(tokens[start:start + self.ngram]))
+            rows = posting if rows is None else np.intersect1d(rows, posting, assume_unique=True)
+            if len(rows) == 0:
+                return rows
+
+        # Confirm the full phrase on the few remaining candidates
+        pattern = re.compile(r'\b' + r'[^0-9a-z]+'.join(tokens) + r'\b')
+        matches = [row for row in rows if pattern.search(self.text_bytes[
+            self.text_offsets[row]:self.text_offsets[row + 1]].decode('utf-8'))]
+        return np.array(matches, dtype=np.int32)
+
+    def query(self, phrase):
+        """Aggregate views and engagement of all captions containing the phrase"""
+        rows = self.lookup(phrase)
+        views = self.views[rows].sum()
+        interactions = self.interactions[rows].sum()
+        return {
+            'videos': len(rows),
+            'total_views': views,
+            'avg_views': views / len(rows) if len(rows) else 0,
+            'total_interactions': interactions,
+            'engagement_rate': round(interactions / views * 100, 2) if views > 0 else np.nan,
+        }
+
+
+# Fixed analyses as SQL over the per-brand views; {brand} is the brand schema
+BRAND_QUERIES = {
+    'weekly_stats': """
+        SELECT weekofyear(createTime) AS week,
+               sum(playCount) AS views_sum, avg(playCount) AS views_mean, count(playCount) AS videos,
+               sum(diggCount) AS likes, sum(shareCount) AS shares, sum(commentCount) AS comments
+        FROM "{brand}".apify
+        WHERE createTime IS NOT NULL
+        GROUP BY week ORDER BY week
+    """,
+    'hourly_views': """
+        SELECT hour(createTime) AS hour, avg(playCount) AS avg_views, count(*) AS videos
+        FROM "{brand}".apify
+        WHERE createTime IS NOT NULL
+        GROUP BY hour ORDER BY hour
+    """,
+    # Same aggregation as compare_video_vs_livestream: sums per date, then the
+    # total views and the mean daily revenue
+    'video_vs_live': """
+        WITH video_daily AS (
+            SELECT "Thời gian phát hành" AS day,
+                   coalesce(sum("Lượt xem"), 0) AS views,
+                   coalesce(sum("Doanh số (VND)"), 0) AS revenue
+            FROM "{brand}".fastmoss_video
+            WHERE "Thời gian phát hành" IS NOT NULL
+            GROUP BY day
+        ), live_daily AS (
+            SELECT "Thời gian bắt đầu Livestream" AS day,
+                   coalesce(sum("Lượt xem"), 0) AS views,
+                   coalesce(sum("Doanh số (VND)"), 0) AS revenue
+            FROM "{brand}".fastmoss_live
+            WHERE "Thời gian bắt đầu Livestream" IS NOT NULL
+            GROUP BY day
+        )
+        SELECT 'video' AS channel, sum(views) AS total_views, avg(revenue) AS avg_revenue
+        FROM video_daily
+        UNION ALL
+        SELECT 'livestream', sum(views), avg(revenue)
+        FROM live_daily
+    """,
+}
+
+
+_worker_analyzer = None
+
+
+def _attach_worker(store_dir):
+    """Process pool initializer: attach this worker to the shared Arrow store"""
+    global _worker_analyzer
+    # Workers never open plot windows
+    plt.switch_backend('Agg')
+    _worker_analyzer = BodyShopAnalytics.attach_shared_store(store_dir)
+
+
+def _run_worker_analysis(method_name):
+    """Run one analysis method inside a worker.
+
+    Returns its results, the columns it derived on the worker's copy of the
+    frames and its figures (pickled) so the parent ends up as after a
+    sequential run.
+    """
+    analyzer = _worker_analyzer
+    analyzer.analysis_results = {}
+    analyzer.posting_time_intervals = {}
+    columns_before = {source: set(getattr(analyzer, source).columns)
+                      for source in analyzer.SHARED_SOURCES if getattr(analyzer, source) is not None}
+
+    getattr(analyzer, method_name)()
+
+    derived = {}
+    for source, columns in columns_before.items():
+        df = getattr(analyzer, source)
+        new_columns = [col for col in df.columns if col not in columns]
+        if new_columns:
+            derived[source] = df[new_columns]
+
+    figures = [pickle.dumps(plt.figure(num)) for num in plt.get_fignums()]
+    plt.close('all')
+    return analyzer.analysis_results, analyzer.posting_time_intervals, derived, figures
+
+
 class BodyShopAnalytics:
+    SHARED_SOURCES = ['karma', 'apify', 'fastmoss_video', 'fastmoss_live', 'fastmoss_product']
+
+    # Stratification (date column, epoch unit) and extrapolated totals for preview mode
+    PREVIEW_STRATA = {
+        'apify': ('createTime', 's'),
+        'fastmoss_video': ('Thời gian phát hành', None),
+        'fastmoss_live': ('Thời gian bắt đầu Livestream', None),
+        'fastmoss_product': ('Thời gian đăng lên', None),
+    }
+    PREVIEW_TOTALS = [
+        ('apify', 'playCount', 'TikTok views'),
+        ('fastmoss_video', 'Lượt xem', 'Video views'),
+        ('fastmoss_video', 'Doanh số (VND)', 'Video revenue (VND)'),
+        ('fastmoss_live', 'Lượt xem', 'Livestream viewers'),
+        ('fastmoss_live', 'Doanh số (VND)', 'Livestream revenue (VND)'),
+        ('fastmoss_product', 'Doanh số (VND)', 'Product revenue (VND)'),
+    ]
+
     def __init__(self):
         self.karma = None
         self.apify = None
@@ -20,6 +405,13 @@ class BodyShopAnalytics:
         self.fastmoss_live = None
         self.fastmoss_product = None
         self.analysis_results = {}
+        self.datetime_reports = {}
+        self._metric_cache = {}
+        self.posting_time_intervals = {}
+        self.caption_indexes = {}
+        self.preview_designs = {}
+        self.preview_estimates = {}
+        self.query_engine = None
 
     def safe_read_excel(self, file_path, sheet_name=None):
         """Safely read Excel files with error handling"""
@@ -35,6 +427,19 @@ class BodyShopAnalytics:
             print(f"❌ Error: File not found - {file_path}")
             return None
 
+    def read_apify_dataset(self, base_name):
+        """Read an Apify dataset, preferring native JSON/NDJSON over Excel"""
+        for extension in ['.ndjson', '.jsonl', '.json']:
+            if os.path.exists(base_name + extension):
+                try:
+                    df = load_apify_dataset(base_name + extension)
+                    print(f"✅ Loaded Apify dataset: {base_name + extension}")
+                    return df
+                except ValueError as e:
+                    print(f"⚠️ Warning: Could not parse {base_name + extension}: {e}")
+                    return None
+        return self.safe_read_excel(base_name + '.xlsx')
+
     def list_excel_sheets(self, file_path):
         """List available sheets in Excel file"""
         try:
@@ -53,7 +458,7 @@ class BodyShopAnalytics:
                                           sheet_name='Metrics Overview')
 
         # Load Apify (TikTok) data
-        self.apify = self.safe_read_excel('[APIFY] The Body Shop.xlsx')
+        self.apify = self.read_apify_dataset('[APIFY] The Body Shop')
 
         # Load FASTMOSS data
         fastmoss_sheets = self.list_excel_sheets('[FASTMOSS] The Body Shop.xlsx')
@@ -78,19 +483,27 @@ class BodyShopAnalytics:
         if self.fastmoss_product is None:
             print("⚠️ Warning: Product data sheet not found.")
 
-    def safe_datetime_convert(self, df, column_name, unit=None):
-        """Safely convert datetime columns"""
+    def safe_datetime_convert(self, df, column_name, unit=None, max_failure_rate=0.05):
+        """Safely convert datetime columns, keeping the original if too many values fail"""
         if df is not None and column_name in df.columns:
             try:
-                if unit:
-                    df[column_name] = pd.to_datetime(df[column_name], unit=unit)
-                else:
-                    df[column_name] = pd.to_datetime(df[column_name])
-                print(f"✅ Converted {column_name} to datetime")
-                return True
+                parsed, report = parse_datetimes(df[column_name], unit=unit)
             except Exception as e:
                 print(f"⚠️ Warning: Could not convert {column_name} to datetime: {e}")
                 return False
+
+            self.datetime_reports[column_name] = report
+            if report['failure_rate'] > max_failure_rate or (
+                    df[column_name].notna().any() and parsed.notna().sum() == 0):
+                print(f"⚠️ Warning: Could not convert {column_name} to datetime: "
+                      f"{report['failure_rate']:.1%} of values unparsed")
+                return False
+
+            df[column_name] = parsed
+            formats = ', '.join(report['formats']) or 'already datetime'
+            print(f"✅ Converted {column_name} to datetime "
+                  f"({formats}; {report['failure_rate']:.1%} unparsed)")
+            return True
         return False
 
     def clean_currency(self, value):
@@ -142,6 +555,8 @@ class BodyShopAnalytics:
         # Handle FASTMOSS video data
         if self.fastmoss_video is not None:
             self.safe_datetime_convert(self.fastmoss_video, 'Thời gian phát hành')
+            if 'Số lượt xem' in self.fastmoss_video.columns:
+                self.fastmoss_video['Lượt xem'] = self.fastmoss_video['Số lượt xem'].apply(self.clean_currency)
             if 'Doanh số bán hàng của video' in self.fastmoss_video.columns:
                 self.fastmoss_video['Doanh số (VND)'] = self.fastmoss_video['Doanh số bán hàng của video'].apply(
                     self.clean_currency)
@@ -149,6 +564,9 @@ class BodyShopAnalytics:
         # Handle FASTMOSS livestream data
         if self.fastmoss_live is not None:
             self.safe_datetime_convert(self.fastmoss_live, 'Thời gian bắt đầu Livestream')
+            if 'Tổng số lượng người xem' in self.fastmoss_live.columns:
+                self.fastmoss_live['Lượt xem'] = self.fastmoss_live['Tổng số lượng người xem'].apply(
+                    self.clean_currency)
             if 'Doanh số Livestream' in self.fastmoss_live.columns:
                 self.fastmoss_live['Doanh số (VND)'] = self.fastmoss_live['Doanh số Livestream'].apply(
                     self.clean_currency)
@@ -157,6 +575,210 @@ class BodyShopAnalytics:
         if self.fastmoss_product is not None and 'Doanh số' in self.fastmoss_product.columns:
             self.fastmoss_product['Doanh số (VND)'] = self.fastmoss_product['Doanh số'].apply(self.clean_currency)
 
+    def get_derived_metric(self, df, metric):
+        """Return a derived metric for a frame, computed once per version of its inputs"""
+        return get_derived_metric(df, metric, DERIVED_METRICS[metric], self._metric_cache)
+
+    def build_caption_indexes(self, index_dir='.analytics_store', ngram=2):
+        """Build caption indexes once per ingest, reusing persisted ones for unchanged data"""
+        for source, config in CAPTION_SOURCES.items():
+            df = getattr(self, source)
+            if df is None or config['views'] not in df.columns:
+                continue
+            text_col = next((col for col in config['text'] if col in df.columns), None)
+            if text_col is None:
+                continue
+
+            interactions = (df[[col for col in config['interactions'] if col in df.columns]]
+                            .apply(pd.to_numeric, errors='coerce').fillna(0).sum(axis=1))
+            fingerprint = frame_fingerprint(pd.DataFrame({
+                'text': df[text_col].astype(str),
+                'views': pd.to_numeric(df[config['views']], errors='coerce'),
+                'interactions': interactions,
+            }))
+
+            path = os.path.join(index_dir, f"captions_{source}.npz")
+            if os.path.exists(path):
+                index = CaptionIndex.load(path)
+                if index.fingerprint == fingerprint and index.ngram == ngram:
+                    self.caption_indexes[source] = index
+                    continue
+
+            index = CaptionIndex.build(df[text_col], df[config['views']], interactions, ngram)
+            index.fingerprint = fingerprint
+            os.makedirs(index_dir, exist_ok=True)
+            index.save(path)
+            self.caption_indexes[source] = index
+            print(f"✅ Built caption index for {source}: {len(index.terms)} terms")
+
+        return self.caption_indexes
+
+    def search_captions(self, phrase):
+        """Aggregate views/engagement of videos whose captions mention a phrase"""
+        if not self.caption_indexes:
+            self.build_caption_indexes()
+        results = {source: index.query(phrase) for source, index in self.caption_indexes.items()}
+        return pd.DataFrame.from_dict(results, orient='index')
+
+    def sample_for_preview(self, n_rows=2000, seed=0):
+        """Replace each source with a sample stratified by week (and KOL category)"""
+        print(f"\n⚡ Preview mode: sampling about {n_rows} rows per source...")
+        for source, (date_col, unit) in self.PREVIEW_STRATA.items():
+            df = getattr(self, source)
+            if df is None:
+                continue
+            strata = preview_strata(df, date_col, unit, category_col='Phân loại KOC/KOL')
+            sample, design = stratified_sample(df, strata, n_rows, seed=seed)
+            setattr(self, source, sample)
+            self.preview_designs[source] = design
+            print(f"  {source}: {len(sample):,} of {len(df):,} rows "
+                  f"from {design['stratum'].nunique()} strata")
+
+    def estimate_preview_totals(self, confidence=0.95):
+        """Extrapolate totals from the preview sample with confidence intervals"""
+        for source, column, label in self.PREVIEW_TOTALS:
+            df = getattr(self, source)
+            if df is None or source not in self.preview_designs or column not in df.columns:
+                continue
+            self.preview_estimates[label] = estimate_total(df[column], self.preview_designs[source],
+                                                           confidence)
+        return self.preview_estimates
+
+    def preview_scale(self, source, column):
+        """Factor from a sample sum to its estimated full-data total (1 outside preview)"""
+        df = getattr(self, source)
+        if df is None or source not in self.preview_designs or column not in df.columns:
+            return 1.0
+        sample_total = pd.to_numeric(df[column], errors='coerce').sum()
+        if not sample_total:
+            return 1.0
+        return estimate_total(df[column], self.preview_designs[source])['estimate'] / sample_total
+
+    def write_shared_store(self, store_dir='.analytics_store'):
+        """Write normalized frames once to memory-mappable Arrow IPC files"""
+        if pa is None:
+            print("⚠️ Warning: pyarrow not installed - shared store disabled")
+            return None
+
+        os.makedirs(store_dir, exist_ok=True)
+        for source in self.SHARED_SOURCES:
+            path = os.path.join(store_dir, f"{source}.arrow")
+            df = getattr(self, source)
+            if df is None:
+                if os.path.exists(path):
+                    os.remove(path)
+                continue
+
+            # Uncompressed IPC files so readers can map the buffers directly
+            table = to_arrow_table(df)
+            # Replace atomically: readers may still have the old file mapped
+            with pa.OSFile(path + '.tmp', 'wb') as sink:
+                with pa_ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(path + '.tmp', path)
+
+        print(f"✅ Shared store written: {store_dir}")
+        return store_dir
+
+    @classmethod
+    def attach_shared_store(cls, store_dir='.analytics_store'):
+        """Create an analyzer whose frames are memory-mapped from the shared store"""
+        analyzer = cls()
+        for source in cls.SHARED_SOURCES:
+            path = os.path.join(store_dir, f"{source}.arrow")
+            if not os.path.exists(path):
+                continue
+            table = pa_ipc.open_file(pa.memory_map(path, 'r')).read_all()
+            # split_blocks keeps null-free numeric columns as views on the mapped file
+            setattr(analyzer, source, table.to_pandas(split_blocks=True))
+        return analyzer
+
+    def write_columnar_tables(self, data_dir='.analytics_store/tables', brand='the_body_shop'):
+        """Write normalized frames as Parquet files for the SQL query engine"""
+        if pa is None:
+            print("⚠️ Warning: pyarrow not installed - columnar tables disabled")
+            return None
+
+        for source in self.SHARED_SOURCES:
+            df = getattr(self, source)
+            if df is None:
+                continue
+            table_dir = os.path.join(data_dir, brand, source)
+            os.makedirs(table_dir, exist_ok=True)
+            path = os.path.join(table_dir, 'part-0.parquet')
+            pq.write_table(to_arrow_table(df), path + '.tmp')
+            os.replace(path + '.tmp', path)
+
+        print(f"✅ Columnar tables written: {os.path.join(data_dir, brand)}")
+        return data_dir
+
+    def connect_query_engine(self, data_dir='.analytics_store/tables', database=':memory:',
+                             memory_limit='2GB', threads=None):
+        """Register every brand's Parquet tables as DuckDB views (schema per brand)"""
+        if duckdb is None:
+            print("⚠️ Warning: duckdb not installed - SQL queries disabled")
+            return None
+
+        con = duckdb.connect(database)
+        # Aggregations larger than memory_limit spill to disk instead of failing
+        con.execute(f"SET memory_limit = '{memory_limit}'")
+        con.execute(f"SET temp_directory = '{os.path.join(data_dir, '.spill')}'")
+        if threads:
+            con.execute(f"SET threads = {int(threads)}")
+
+        for brand in sorted(os.listdir(data_dir)) if os.path.isdir(data_dir) else []:
+            brand_dir = os.path.join(data_dir, brand)
+            if brand.startswith('.') or not os.path.isdir(brand_dir):
+                continue
+            con.execute(f'CREATE SCHEMA IF NOT EXISTS "{brand}"')
+            for source in sorted(os.listdir(brand_dir)):
+                pattern = os.path.join(brand_dir, source, '*.parquet')
+                con.execute(f'CREATE OR REPLACE VIEW "{brand}"."{source}" AS '
+                            f"SELECT * FROM read_parquet('{pattern}', union_by_name = true)")
+
+        self.query_engine = con
+        return con
+
+    def query(self, sql, brand='the_body_shop'):
+        """Run SQL (or a BRAND_QUERIES name) against the registered views"""
+        if self.query_engine is None and self.connect_query_engine() is None:
+            return None
+
+        # Only named queries are templates; ad-hoc SQL may contain braces of its own
+        if sql in BRAND_QUERIES:
+            sql = BRAND_QUERIES[sql].format(brand=brand)
+        try:
+            return self.query_engine.execute(sql).df()
+        except duckdb.Error as e:
+            print(f"❌ Query failed: {e}")
+            return None
+
+    def run_parallel_analyses(self, method_names, store_dir='.analytics_store', max_workers=None):
+        """Run analysis methods in worker processes sharing one Arrow store"""
+        if self.write_shared_store(store_dir) is None:
+            for method_name in method_names:
+                getattr(self, method_name)()
+            return self.analysis_results
+
+        print(f"\n⚡ Running {len(method_names)} analyses in parallel...")
+        with ProcessPoolExecutor(max_workers=max_workers or len(method_names),
+                                 initializer=_attach_worker,
+                                 initargs=(store_dir,)) as pool:
+            # Merge in submission order so results match a sequential run
+            for results, intervals, derived, figures in pool.map(_run_worker_analysis, method_names):
+                self.analysis_results.update(results)
+                self.posting_time_intervals.update(intervals)
+                for source, columns in derived.items():
+                    df = getattr(self, source)
+                    for col in columns.columns:
+                        df[col] = columns[col].array
+                # Unpickled figures re-register with pyplot in this process
+                for figure in figures:
+                    pickle.loads(figure)
+
+        plt.show()
+        return self.analysis_results
+
     def analyze_tiktok_engagement(self):
         """Analyze TikTok engagement patterns"""
         if self.karma is None:
@@ -180,31 +802,50 @@ class BodyShopAnalytics:
                 break
 
         if date_col and engagement_col:
-            # Create engagement over time plot
-            plt.figure(figsize=(12, 6))
-            sns.lineplot(data=self.karma, x=date_col, y=engagement_col)
-            plt.title("TikTok Engagement Over Time", fontsize=14, fontweight='bold')
-            plt.xlabel("Date")
-            plt.ylabel("Engagement")
-            plt.xticks(rotation=45)
-            plt.grid(True, alpha=0.3)
-            plt.tight_layout()
-            plt.show()
+            engagement = pd.to_numeric(self.karma[engagement_col], errors='coerce')
 
-            # Calculate basic statistics
+            # Calculate basic statistics on the full data
             fb_stats = {
-                'total_engagement': self.karma[engagement_col].sum(),
-                'avg_daily_engagement': self.karma[engagement_col].mean(),
-                'peak_engagement': self.karma[engagement_col].max(),
-                'peak_date': self.karma.loc[self.karma[engagement_col].idxmax(), date_col]
+                'total_engagement': engagement.sum(),
+                'avg_daily_engagement': engagement.mean(),
+                'peak_engagement': engagement.max(),
+                'peak_date': self.karma.loc[engagement.idxmax(), date_col]
             }
 
-            self.analysis_results['tiktok'] = fb_stats
+            # Create engagement over time plot
+            fig, ax = plt.subplots(figsize=(12, 6))
+            self.plot_time_series(self.karma[date_col], engagement, ax)
+            ax.scatter([fb_stats['peak_date']], [fb_stats['peak_engagement']],
+                       color='red', zorder=3, label='Peak')
+            ax.set_title("TikTok Engagement Over Time", fontsize=14, fontweight='bold')
+            ax.set_xlabel("Date")
+            ax.set_ylabel("Engagement")
+            ax.tick_params(axis='x', rotation=45)
+            ax.grid(True, alpha=0.3)
+            ax.legend()
+            plt.tight_layout()
+            plt.show()
+
+            self.analysis_results['tiktok_engagement'] = fb_stats
             return fb_stats
         else:
             print(f"⚠️ Required columns not found. Available: {self.karma.columns.tolist()}")
             return None
 
+    def plot_time_series(self, x, y, ax, **plot_kwargs):
+        """Plot a long series downsampled to the pixel width of the axes.
+
+        Rows sharing an x value are averaged (what sns.lineplot draws, minus
+        its bootstrapped confidence band), then min/max bucketing keeps the
+        shape and peaks while the number of drawn points stays constant.
+        """
+        series = pd.DataFrame({'x': x, 'y': y}).dropna().groupby('x')['y'].mean()
+        if series.empty:
+            return
+        n_buckets = max(int(ax.get_window_extent().width), 1)
+        x_values, y_values = minmax_downsample(series.index.to_numpy(), series.to_numpy(), n_buckets)
+        ax.plot(x_values, y_values, **plot_kwargs)
+
     def analyze_tiktok_performance(self):
         """Analyze TikTok video performance"""
         if self.apify is None:
@@ -238,13 +879,11 @@ class BodyShopAnalytics:
                 }).round(2)
 
                 # Calculate engagement rate
-                total_interactions = (self.apify['diggCount'].fillna(0) +
-                                      self.apify['shareCount'].fillna(0) +
-                                      self.apify['commentCount'].fillna(0))
-                self.apify['engagement_rate'] = (total_interactions / self.apify['playCount'] * 100).round(2)
+                self.apify['engagement_rate'] = self.get_derived_metric(self.apify, 'engagement_rate')
 
                 # Posting time analysis
                 self.plot_posting_patterns()
+                self.recommend_posting_times()
 
                 # Performance metrics
                 tiktok_stats = {
@@ -252,7 +891,8 @@ class BodyShopAnalytics:
                     'total_views': self.apify['playCount'].sum(),
                     'avg_views_per_video': self.apify['playCount'].mean(),
                     'avg_engagement_rate': self.apify['engagement_rate'].mean(),
-                    'best_posting_hour': self.apify.groupby('hour')['playCount'].mean().idxmax()
+                    # None unless one hour's views CI clears all the others
+                    'best_posting_hour': self.analysis_results['posting_times']['best_hour']
                 }
 
                 self.analysis_results['tiktok'] = tiktok_stats
@@ -260,6 +900,31 @@ class BodyShopAnalytics:
 
         return None
 
+    def recommend_posting_times(self, n_resamples=10000, confidence=0.95, seed=0):
+        """Find posting hours/weekdays whose mean views are statistically separated"""
+        if self.apify is None or 'hour' not in self.apify.columns:
+            return None
+
+        recommendations = {}
+        for bucket in ['hour', 'weekday']:
+            if bucket not in self.apify.columns:
+                continue
+            intervals = bootstrap_bucket_means(self.apify['playCount'], self.apify[bucket],
+                                               n_resamples=n_resamples,
+                                               confidence=confidence, seed=seed)
+            self.posting_time_intervals[bucket] = intervals
+
+            winner = separated_winner(intervals)
+            recommendations[f'best_{bucket}'] = winner
+            if winner is not None:
+                recommendations[f'best_{bucket}_views'] = intervals.loc[winner, 'mean']
+                recommendations[f'best_{bucket}_ci_low'] = intervals.loc[winner, 'ci_low']
+                recommendations[f'best_{bucket}_ci_high'] = intervals.loc[winner, 'ci_high']
+
+        recommendations['confidence'] = confidence
+        self.analysis_results['posting_times'] = recommendations
+        return recommendations
+
     def plot_posting_patterns(self):
         """Plot TikTok posting patterns"""
         if self.apify is None or 'hour' not in self.apify.columns:
@@ -316,10 +981,13 @@ class BodyShopAnalytics:
         if video_metrics is not None and live_metrics is not None:
             self.plot_video_vs_live_comparison(video_metrics, live_metrics)
 
-            # Calculate comparison stats
+            # Calculate comparison stats; in preview, totals are extrapolated per source
+            # because video and livestream rows are sampled at different rates
             comparison_stats = {
-                'video_total_views': video_metrics['Lượt xem'].sum() if 'Lượt xem' in video_metrics.columns else 0,
-                'live_total_views': live_metrics['Lượt xem'].sum() if 'Lượt xem' in live_metrics.columns else 0,
+                'video_total_views': video_metrics['Lượt xem'].sum() * self.preview_scale(
+                    'fastmoss_video', 'Lượt xem') if 'Lượt xem' in video_metrics.columns else 0,
+                'live_total_views': live_metrics['Lượt xem'].sum() * self.preview_scale(
+                    'fastmoss_live', 'Lượt xem') if 'Lượt xem' in live_metrics.columns else 0,
                 'video_avg_revenue': video_metrics[
                     'Doanh số (VND)'].mean() if 'Doanh số (VND)' in video_metrics.columns else 0,
                 'live_avg_revenue': live_metrics[
@@ -403,8 +1071,8 @@ class BodyShopAnalytics:
         # Efficiency metrics
         if ('Doanh số (VND)' in video_data.columns and 'Lượt xem' in video_data.columns and
                 'Doanh số (VND)' in live_data.columns and 'Lượt xem' in live_data.columns):
-            video_efficiency = video_data['Doanh số (VND)'] / video_data['Lượt xem']
-            live_efficiency = live_data['Doanh số (VND)'] / live_data['Lượt xem']
+            video_efficiency = self.get_derived_metric(video_data, 'revenue_per_view')
+            live_efficiency = self.get_derived_metric(live_data, 'revenue_per_view')
 
             axes[1, 1].hist([video_efficiency.dropna(), live_efficiency.dropna()],
                             bins=20, alpha=0.7, label=['Video', 'Livestream'])
@@ -437,25 +1105,53 @@ class BodyShopAnalytics:
         # Add insights based on analysis results
         if 'tiktok' in self.analysis_results:
             tiktok_stats = self.analysis_results['tiktok']
+            total_videos = tiktok_stats['total_videos']
+            total_views = tiktok_stats['total_views']
+            scope = ""
+            if 'apify' in self.preview_designs:
+                # Population size per stratum is known exactly; views are extrapolated
+                total_videos = self.preview_designs['apify'].groupby('stratum')['population'].first().sum()
+                total_views *= self.preview_scale('apify', 'playCount')
+                scope = " (estimated from preview sample)"
             report['key_insights'].append(
-                f"TikTok Performance: {tiktok_stats['total_videos']} videos with "
-                f"{tiktok_stats['total_views']:,.0f} total views and "
+                f"TikTok Performance{scope}: {total_videos} videos with "
+                f"{total_views:,.0f} total views and "
                 f"{tiktok_stats['avg_engagement_rate']:.2f}% average engagement rate"
             )
 
-            if tiktok_stats['best_posting_hour']:
+        if 'posting_times' in self.analysis_results:
+            posting = self.analysis_results['posting_times']
+            level = f"{posting['confidence']:.0%}"
+            if posting.get('best_hour') is not None:
+                report['recommendations'].append(
+                    f"Optimal posting time: {int(posting['best_hour'])}:00 "
+                    f"({posting['best_hour_views']:,.0f} avg views, {level} CI "
+                    f"{posting['best_hour_ci_low']:,.0f}-{posting['best_hour_ci_high']:,.0f})"
+                )
+            else:
+                report['recommendations'].append(
+                    f"No posting hour clearly outperforms the others at {level} confidence"
+                )
+            if posting.get('best_weekday') is not None:
                 report['recommendations'].append(
-                    f"Optimal posting time: {tiktok_stats['best_posting_hour']}:00 "
-                    f"based on highest average views"
+                    f"Optimal posting day: {posting['best_weekday']} "
+                    f"({posting['best_weekday_views']:,.0f} avg views, {level} CI "
+                    f"{posting['best_weekday_ci_low']:,.0f}-{posting['best_weekday_ci_high']:,.0f})"
                 )
 
-        if 'tiktok' in self.analysis_results:
-            fb_stats = self.analysis_results['tiktok']
+        if 'tiktok_engagement' in self.analysis_results:
+            fb_stats = self.analysis_results['tiktok_engagement']
             report['key_insights'].append(
                 f"Tiktok Engagement: Peak engagement of {fb_stats['peak_engagement']:,.0f} "
                 f"on {fb_stats['peak_date']}"
             )
 
+        for label, estimate in self.preview_estimates.items():
+            report['key_insights'].append(
+                f"Preview estimate - {label}: {estimate['estimate']:,.0f} "
+                f"(95% CI {estimate['ci_low']:,.0f} to {estimate['ci_high']:,.0f})"
+            )
+
         if 'comparison' in self.analysis_results:
             comp_stats = self.analysis_results['comparison']
             if comp_stats['video_total_views'] > comp_stats['live_total_views']:
@@ -484,11 +1180,9 @@ class BodyShopAnalytics:
         if self.apify is not None:
             # Add calculated metrics to TikTok data
             apify_export = self.apify.copy()
-            if 'engagement_rate' not in apify_export.columns and 'playCount' in apify_export.columns:
-                total_interactions = (apify_export['diggCount'].fillna(0) +
-                                      apify_export['shareCount'].fillna(0) +
-                                      apify_export['commentCount'].fillna(0))
-                apify_export['engagement_rate'] = (total_interactions / apify_export['playCount'] * 100).round(2)
+            engagement_rate = self.get_derived_metric(self.apify, 'engagement_rate')
+            if engagement_rate is not None:
+                apify_export['engagement_rate'] = engagement_rate
 
             sheets_to_export["TikTok_Data"] = apify_export
 
@@ -545,23 +1239,35 @@ class BodyShopAnalytics:
         else:
             print("❌ No data available for export")
 
-    def run_complete_analysis(self):
-        """Run the complete analysis pipeline"""
+    def run_complete_analysis(self, parallel=False, preview=False):
+        """Run the complete analysis pipeline (on a stratified sample if preview)"""
         print("🚀 Starting The Body Shop Social Media Analytics")
         print("=" * 50)
 
         # Load and normalize data
         self.load_data()
+        if preview:
+            self.sample_for_preview()
         self.normalize_data()
+        if preview:
+            self.estimate_preview_totals()
+        else:
+            self.build_caption_indexes()
+            self.write_columnar_tables()
 
         # Run analyses
-        self.analyze_tiktok_engagement()
-        self.analyze_tiktok_performance()
-        self.compare_video_vs_livestream()
+        analyses = ['analyze_tiktok_engagement', 'analyze_tiktok_performance',
+                    'compare_video_vs_livestream']
+        if parallel:
+            self.run_parallel_analyses(analyses)
+        else:
+            for method_name in analyses:
+                getattr(self, method_name)()
 
-        # Generate report and export
+        # Generate report and export (preview results are never exported)
         report = self.generate_insights_report()
-        self.export_results()
+        if not preview:
+            self.export_results()
 
         # Print final summary
         print("\n🎉 Analysis Complete!")
@@ -0,0 +1,338 @@
+"""Helpers shared by the brand analytics scripts (The Body Shop, Cỏ Mềm)"""
+import pandas as pd
+import numpy as np
+import codecs
+import io
+import json
+import warnings
+from statistics import NormalDist
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+try:
+    from pandas.tseries.api import guess_datetime_format
+except ImportError:
+    guess_datetime_format = None
+
+
+def to_arrow_table(df):
+    """Convert a DataFrame to an Arrow table, stringifying only the columns Arrow rejects"""
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        df = df.copy()
+        for col in df.select_dtypes(include='object').columns:
+            try:
+                pa.array(df[col], from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                df[col] = df[col].map(lambda value: None if pd.isna(value) else str(value))
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def _json_array_element_ends(body):
+    """Offsets just past each complete top-level element of a JSON array body.
+
+    Structural scan in numpy over quotes and brackets only: a quote after an
+    odd run of backslashes is escaped, unescaped quotes toggle the string
+    state, and an element ends where the bracket depth outside strings
+    returns to zero.
+    """
+    data = np.frombuffer(body, dtype=np.uint8)
+
+    escaped = np.empty(0, dtype=np.intp)
+    backslashes = np.flatnonzero(data == ord('\\'))
+    if len(backslashes):
+        run_starts = np.flatnonzero(np.r_[True, np.diff(backslashes) != 1])
+        run_ends = np.r_[backslashes[run_starts[1:] - 1], backslashes[-1]]
+        run_lengths = run_ends - backslashes[run_starts] + 1
+        escaped = run_ends[run_lengths % 2 == 1] + 1
+
+    tokens = np.flatnonzero((data == ord('"')) | (data == ord('{')) | (data == ord('}')) |
+                            (data == ord('[')) | (data == ord(']')))
+    tokens = tokens[~np.isin(tokens, escaped)]
+    chars = data[tokens]
+    outside = np.cumsum(chars == ord('"')) % 2 == 0
+    opens = outside & ((chars == ord('{')) | (chars == ord('[')))
+    closes = outside & ((chars == ord('}')) | (chars == ord(']')))
+    depth = np.cumsum(opens.astype(np.intp) - closes)
+    return tokens[closes & (depth == 0)] + 1
+
+
+def iter_json_records(path, chunk_size=1 << 16):
+    """Stream records from an Apify dataset stored as a JSON array or NDJSON"""
+    with open(path, 'rb') as f:
+        buffer = f.read(chunk_size)
+        if buffer.startswith(codecs.BOM_UTF8):
+            buffer = buffer[len(codecs.BOM_UTF8):]
+        buffer = buffer.lstrip()
+
+        if not buffer.startswith(b'['):
+            # NDJSON: one record per line
+            f.seek(0)
+            for line in io.TextIOWrapper(f, encoding='utf-8-sig'):
+                if line.strip():
+                    yield json_loads(line)
+            return
+
+        # JSON array: decode all complete elements of the buffer in one call
+        buffer = buffer[1:]
+        while True:
+            buffer = buffer.lstrip(b', \t\r\n')
+            ends = _json_array_element_ends(buffer)
+            if len(ends):
+                yield from json_loads(b'[' + buffer[:ends[-1]] + b']')
+                buffer = buffer[ends[-1]:]
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            buffer += chunk
+
+        if buffer.strip() != b']':
+            raise ValueError(f"Unterminated JSON array in {path}")
+
+
+def flatten_record(record, sep='/', prefix=''):
+    """Flatten nested dicts and lists the same way Apify's Excel export does"""
+    flat = {}
+    items = record.items() if isinstance(record, dict) else enumerate(record)
+    for key, value in items:
+        name = f"{prefix}{key}"
+        if isinstance(value, (dict, list)):
+            flat.update(flatten_record(value, sep, name + sep))
+        else:
+            flat[name] = value
+    return flat
+
+
+def load_apify_dataset(path, sep='/', batch_size=5000):
+    """Load a native Apify JSON/NDJSON dataset into flattened columns"""
+    frames = []
+    batch = []
+    for record in iter_json_records(path):
+        batch.append(record)
+        if len(batch) >= batch_size:
+            frames.append(pd.DataFrame.from_records([flatten_record(r, sep) for r in batch]))
+            batch = []
+    if batch:
+        frames.append(pd.DataFrame.from_records([flatten_record(r, sep) for r in batch]))
+
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+
+DATETIME_FORMATS = [
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d',
+    '%d/%m/%Y %H:%M:%S',
+    '%d/%m/%Y',
+    '%b %d, %Y',
+    '%H:%M:%S',
+    'ISO8601',
+]
+
+# Literal zone labels FastMoss appends to local times, e.g. '2025-05-06 10:00:00(UTC+7)'
+ZONE_LABEL = r'\s*\(UTC[+-]\d{1,2}(?::\d{2})?\)$'
+
+
+def to_datetime_coerce(values, fmt=None):
+    """pd.to_datetime with errors='coerce'; mixed timezones become naive UTC instead of raising"""
+    try:
+        return pd.to_datetime(values, format=fmt, errors='coerce')
+    except ValueError:
+        return pd.to_datetime(values, format=fmt, errors='coerce', utc=True).dt.tz_localize(None)
+
+
+def day_month_order(fmt):
+    """'dm' or 'md' for formats holding both a day and a month number, else None"""
+    if '%d' not in fmt or '%m' not in fmt:
+        return None
+    return 'dm' if fmt.index('%d') < fmt.index('%m') else 'md'
+
+
+def infer_datetime_format(values, sample_size=200, order=None):
+    """Pick the format that parses the largest share of a small sample.
+
+    Formats whose day/month order contradicts `order` are never picked.
+    """
+    sample = pd.Series(values).dropna().astype(str)
+    sample = sample.sample(min(sample_size, len(sample)), random_state=0)
+    if sample.empty:
+        return None
+
+    # Known formats first so they win ties (day-first, ISO); then guesses from
+    # several values, so the pick does not hinge on whichever row comes first
+    guessed = set()
+    if guess_datetime_format is not None:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            guessed = {guess_datetime_format(value, dayfirst=True) for value in sample.head(10)}
+    candidates = DATETIME_FORMATS + sorted(fmt for fmt in guessed if fmt and fmt not in DATETIME_FORMATS)
+    if order is not None:
+        candidates = [fmt for fmt in candidates if day_month_order(fmt) in (None, order)]
+
+    best_format, best_rate = None, 0.0
+    for fmt in candidates:
+        rate = to_datetime_coerce(sample, fmt).notna().mean()
+        if rate > best_rate:
+            best_format, best_rate = fmt, rate
+        if rate == 1.0:
+            break
+    return best_format
+
+
+def parse_datetimes(values, unit=None, extract_pattern=None):
+    """Parse a column with inferred explicit formats, once per unique value.
+
+    Returns the parsed series and a report with the formats used and the
+    share of non-empty values that could not be parsed.
+    """
+    values = pd.Series(values)
+    present = int(values.notna().sum())
+
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values, {'formats': [], 'unique': None, 'failed': 0, 'failure_rate': 0.0}
+    if unit:
+        parsed = pd.to_datetime(pd.to_numeric(values, errors='coerce'), unit=unit)
+        failed = int((parsed.isna() & values.notna()).sum())
+        return parsed, {'formats': [f'unit={unit}'], 'unique': None, 'failed': failed,
+                        'failure_rate': failed / max(present, 1)}
+
+    # Parse each distinct string once and broadcast back through the codes
+    codes, uniques = pd.factorize(values)
+    pending = pd.Series(uniques).astype(str)
+    # Without the label pandas takes its ISO fast path instead of strptime;
+    # the times stay local, as with the literal-label format before
+    pending = pending.str.replace(ZONE_LABEL, '', regex=True)
+    pieces = []
+    formats = []
+
+    # Leftovers may need another format, but never one that swaps day and
+    # month relative to a format already used; those values count as failed
+    order = None
+    while not pending.empty:
+        fmt = infer_datetime_format(pending, order=order)
+        if fmt is None:
+            break
+        parsed = to_datetime_coerce(pending, fmt)
+        if parsed.notna().sum() == 0:
+            break
+        pieces.append(parsed.dropna())
+        formats.append(fmt)
+        order = order or day_month_order(fmt)
+        pending = pending[parsed.isna()]
+
+    if extract_pattern and not pending.empty:
+        extracted = pending.str.extract(extract_pattern)[0]
+        parsed = to_datetime_coerce(extracted)
+        pieces.append(parsed.dropna())
+        pending = pending[parsed.isna()]
+
+    # Formats that disagree on timezone are normalised to naive UTC
+    if len({str(getattr(piece.dt, 'tz', None)) for piece in pieces}) > 1:
+        pieces = [piece.dt.tz_convert('UTC').dt.tz_localize(None)
+                  if piece.dt.tz is not None else piece for piece in pieces]
+
+    if pieces:
+        parsed_uniques = pd.concat(pieces).reindex(range(len(uniques)))
+    else:
+        parsed_uniques = pd.Series(pd.NaT, index=range(len(uniques)), dtype='datetime64[ns]')
+
+    # take() maps code -1 (missing input) to NaT
+    result = pd.Series(parsed_uniques.array.take(codes, allow_fill=True),
+                       index=values.index, name=values.name)
+
+    failed = int(np.isin(codes, pending.index).sum())
+    report = {
+        'formats': formats,
+        'unique': len(uniques),
+        'failed': failed,
+        'failure_rate': failed / max(present, 1),
+    }
+    return result, report
+
+
+def compute_derived_metric(df, spec):
+    """Compute a ratio metric; missing numerators count as 0, non-positive denominators give NaN"""
+    numerator_cols = [col for col in spec['numerator'] if col in df.columns]
+    numerator = df[numerator_cols].apply(pd.to_numeric, errors='coerce').fillna(0).sum(axis=1)
+    denominator = pd.to_numeric(df[spec['denominator']], errors='coerce')
+    values = numerator / denominator.where(denominator > 0) * spec.get('scale', 1)
+    if 'round' in spec:
+        values = values.round(spec['round'])
+    return values
+
+
+def get_derived_metric(df, metric, spec, cache):
+    """Return a derived metric for a frame, computed once per version of its inputs.
+
+    `cache` keeps only the latest version per metric and input columns, so
+    it holds one Series per metric rather than one per frame ever seen.
+    """
+    columns = [col for col in spec['numerator'] if col in df.columns]
+    if not columns or spec['denominator'] not in df.columns:
+        return None
+
+    columns.append(spec['denominator'])
+    key = (metric, tuple(columns))
+    version = int(pd.util.hash_pandas_object(df[columns]).sum())
+    cached = cache.get(key)
+    if cached is None or cached[0] != version:
+        cached = cache[key] = (version, compute_derived_metric(df, spec))
+    return cached[1]
+
+
+def preview_strata(df, date_col=None, unit=None, category_col=None):
+    """Stratum label per row: ISO week of the date column, plus category where present"""
+    strata = pd.Series('all', index=df.index)
+    if date_col in df.columns:
+        dates, _ = parse_datetimes(df[date_col], unit=unit)
+        iso = dates.dt.isocalendar()
+        strata = (iso['year'].astype(str) + '-W' + iso['week'].astype(str)).where(dates.notna(), 'no date')
+    if category_col in df.columns:
+        strata = strata + ' | ' + df[category_col].fillna('unknown').astype(str)
+    return strata
+
+
+def stratified_sample(df, strata, n_rows=2000, min_per_stratum=2, seed=0):
+    """Sample rows with proportional allocation per stratum.
+
+    Returns the sample and its design: stratum, population size and sample
+    size for every sampled row, as needed by estimate_total.
+    """
+    population = strata.map(strata.value_counts())
+    fraction = min(1.0, n_rows / max(len(df), 1))
+    wanted = np.minimum(population, np.maximum(np.ceil(population * fraction), min_per_stratum))
+
+    # Random rank within each stratum; keep the first `wanted` rows of each
+    rank = (pd.Series(np.random.default_rng(seed).random(len(df)), index=df.index)
+            .groupby(strata).rank(method='first'))
+    keep = rank <= wanted
+
+    sample = df[keep]
+    design = pd.DataFrame({'stratum': strata[keep], 'population': population[keep]})
+    design['sampled'] = design['stratum'].map(design['stratum'].value_counts())
+    return sample, design
+
+
+def estimate_total(values, design, confidence=0.95):
+    """Stratified estimate of a population total with a normal-approximation CI"""
+    values = pd.to_numeric(values, errors='coerce').fillna(0)
+    grouped = values.groupby(design['stratum'])
+    population = design.groupby('stratum')['population'].first()
+    sampled = design.groupby('stratum')['sampled'].first()
+
+    total = (population * grouped.mean()).sum()
+    # Finite population correction; strata sampled in full contribute no error
+    variance = (population ** 2 * (1 - sampled / population) * grouped.var(ddof=1).fillna(0) / sampled).sum()
+    margin = NormalDist().inv_cdf(0.5 + confidence / 2) * np.sqrt(variance)
+    return {'estimate': total, 'ci_low': total - margin, 'ci_high': total + margin}